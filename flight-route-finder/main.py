@@ -5,38 +5,64 @@ A command-line application to find flight routes between cities using preprocess
 This module serves as the entry point for the flight route finder application.
 """
 
+import os
 import sys
 import argparse
 import pandas as pd
 from datetime import datetime
-import re
 import difflib
 
+try:
+    from rapidfuzz import fuzz, process as fuzz_process
+except ImportError:
+    fuzz_process = None
+
+from src import preprocessing
 from src.preprocessing import (
-    extract_city_names,
-    extract_coordinates,
-    process_time_columns,
-    fill_missing_amount_by_route_type,
+    preprocess_all,
     city_to_airports_map
 )
 from src.flight_functions import (
-    build_flight_graph,
-    find_all_paths,
-    get_path_details,
-    select_best_routes
+    build_flight_graph_full,
+    filter_edges_by_time,
+    find_best_routes
 )
 
 
-def match_city(input_city, cities):
-    """Case-insensitive and fuzzy match of input_city to cities list."""
-    # Normalize: lowercase and remove non-letter characters
-    input_norm = re.sub(r'[^a-z]', '', input_city.strip().lower())
-    # Map normalized city keys to original names
-    city_map = {re.sub(r'[^a-z]', '', city.lower()): city for city in cities}
+# Deletes every ASCII character that is not a letter (str.translate is a C-level table lookup)
+_NON_LETTERS = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isalpha()))
+
+
+def normalize_city(name):
+    """Lowercase a city name and drop spaces, punctuation and digits."""
+    return name.lower().translate(_NON_LETTERS)
+
+
+def build_city_map(cities):
+    """Map normalized city names to the original names; build once and reuse for every lookup."""
+    return {normalize_city(city): city for city in cities}
+
+
+def match_city(input_city, city_map):
+    """
+    Case-insensitive and fuzzy match of input_city to the available cities.
+
+    :param city_map: dict from build_city_map (a plain list of cities also works, but is re-normalized on every call)
+
+    >>> city_map = build_city_map(['Moscow', 'St. Petersburg'])
+    >>> match_city(' st petersburg ', city_map), match_city('Moskow', city_map), match_city('Kazan', city_map)
+    ('St. Petersburg', 'Moscow', None)
+    """
+    if not isinstance(city_map, dict):
+        city_map = build_city_map(city_map)
+    input_norm = normalize_city(input_city.strip())
     # Exact normalized match
     if input_norm in city_map:
         return city_map[input_norm]
-    # Fuzzy match on normalized keys
+    # Fuzzy match on normalized keys: rapidfuzz when installed, difflib otherwise (same ratio scale)
+    if fuzz_process is not None:
+        match = fuzz_process.extractOne(input_norm, city_map.keys(), scorer=fuzz.ratio, score_cutoff=70)
+        return city_map[match[0]] if match else None
     close = difflib.get_close_matches(input_norm, city_map.keys(), n=1, cutoff=0.7)
     if close:
         return city_map[close[0]]
@@ -47,15 +73,104 @@ def parse_arguments():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description='Flight Route Finder')
     parser.add_argument('--data', type=str, default='data/processed/flight_ticket_summary.csv',
-                        help='Path to the flight data file (CSV)')
+                        help='Path to the flight data file (CSV or Parquet)')
+    parser.add_argument('--fast-io', action='store_true',
+                        help='Read the CSV with polars when it is installed')
     return parser.parse_args()
 
 
-def load_and_preprocess_data(file_path):
-    """Load flight data from CSV and preprocess it."""
+# Columns used by preprocessing and the route search, for both the raw export (JSON city and
+# coordinate strings) and the SQL-cleaned one (city names and numeric coordinates).
+# Anything else in the CSV, e.g. ticket_count, is not loaded.
+FLIGHT_COLUMNS = [
+    'flight_id', 'flight_no', 'scheduled_departure', 'scheduled_arrival',
+    'departure_airport', 'arrival_airport', 'fare_conditions', 'amount',
+    'departure_city', 'arrival_city', 'departure_coordinates', 'arrival_coordinates',
+    'departure_city_name', 'arrival_city_name',
+    'departure_longitude', 'departure_latitude', 'arrival_longitude', 'arrival_latitude'
+]
+
+# Compact dtypes applied after reading, whichever reader was used
+FLIGHT_DTYPES = {'flight_id': 'int32', 'fare_conditions': 'category'}
+
+
+def read_flight_csv(file_path, fast_io=False):
+    """
+    Read the flight CSV with the fastest reader available, keeping the pandas C-engine schema.
+    Only FLIGHT_COLUMNS are loaded, with the compact FLIGHT_DTYPES. A '.parquet' file (the
+    Parquet export of connect_and_merge_data.py) is read with pandas' Parquet reader instead.
+
+    With fast_io, polars is tried first. Otherwise pyarrow's multithreaded reader is used when
+    installed; the time columns are kept as strings so process_time_columns still sees the
+    original '+03' offsets rather than pyarrow's UTC conversion.
+    """
+    if file_path.endswith('.parquet'):
+        # Parquet export of connect_and_merge_data.py: columnar, so only the needed columns are read
+        import pyarrow.parquet as pq
+        columns = [col for col in pq.read_schema(file_path).names if col in FLIGHT_COLUMNS]
+        df = pd.read_parquet(file_path, columns=columns)
+        return df.astype({col: dtype for col, dtype in FLIGHT_DTYPES.items() if col in df.columns})
+
+    columns = [col for col in pd.read_csv(file_path, nrows=0).columns if col in FLIGHT_COLUMNS]
+    df = None
+
+    if fast_io:
+        try:
+            import polars as pl
+            df = pl.read_csv(file_path, columns=columns).to_pandas()
+        except ImportError:
+            print("polars is not installed, falling back to the default reader.")
+
+    if df is None:
+        try:
+            import pyarrow as pa
+            from pyarrow import csv as pa_csv
+        except ImportError:
+            df = pd.read_csv(file_path, usecols=columns)
+        else:
+            convert_options = pa_csv.ConvertOptions(
+                strings_can_be_null=True,
+                include_columns=columns,
+                column_types={col: pa.string() for col in ('scheduled_departure', 'scheduled_arrival')}
+            )
+            df = pa_csv.read_csv(file_path, convert_options=convert_options).to_pandas()
+
+    return df.astype({col: dtype for col, dtype in FLIGHT_DTYPES.items() if col in df.columns})
+
+
+def _cache_is_fresh(cache_path, file_path):
+    """
+    A cache is fresh if it is newer than the CSV and the code that produced it: the
+    preprocessing module, and this module (FLIGHT_COLUMNS, FLIGHT_DTYPES, read_flight_csv).
+    """
+    if not os.path.exists(cache_path) or not os.path.exists(file_path):
+        return False
+    cache_mtime = os.path.getmtime(cache_path)
+    return (cache_mtime >= os.path.getmtime(file_path)
+            and cache_mtime >= os.path.getmtime(preprocessing.__file__)
+            and cache_mtime >= os.path.getmtime(__file__))
+
+
+def load_and_preprocess_data(file_path, fast_io=False):
+    """
+    Load flight data from CSV and preprocess it.
+    The preprocessed frame is cached as Parquet next to the CSV, so later runs skip both steps.
+    Parquet input is already fast to read, so it is not cached again.
+    """
+    cache_path = None if file_path.endswith('.parquet') else file_path + '.parquet'
+    if cache_path is not None and _cache_is_fresh(cache_path, file_path):
+        try:
+            print(f"Loading preprocessed flight data from {cache_path}...")
+            df = pd.read_parquet(cache_path)
+            city_airports = city_to_airports_map(df)
+            print(f"Data loaded. {len(df)} flights available.")
+            return df, city_airports
+        except Exception as e:
+            print(f"Could not read cache ({e}), preprocessing the CSV instead.")
+
     try:
         print(f"Loading flight data from {file_path}...")
-        df = pd.read_csv(file_path)
+        df = read_flight_csv(file_path, fast_io)
     except Exception as e:
         print(f"Error loading data: {e}")
         sys.exit(1)
@@ -63,10 +178,14 @@ def load_and_preprocess_data(file_path):
     print("Preprocessing flight data...")
 
     # Apply preprocessing functions
-    df = extract_city_names(df)
-    df = extract_coordinates(df)
-    df = process_time_columns(df)
-    df = fill_missing_amount_by_route_type(df)
+    df = preprocess_all(df)
+
+    # Cache the result; needs a Parquet engine (pyarrow or fastparquet)
+    if cache_path is not None:
+        try:
+            df.to_parquet(cache_path, compression='zstd')
+        except Exception as e:
+            print(f"Could not cache preprocessed data: {e}")
 
     # Create city to airports mapping
     city_airports = city_to_airports_map(df)
@@ -80,20 +199,20 @@ def get_cities_list(city_airports):
     return sorted(city_airports.keys())
 
 
-def get_user_input(cities):
+def get_user_input(city_map):
     """Get user input for departure and arrival cities and departure date/time."""
     while True:
         try:
             # Get departure city
             raw_dep = input("\nDeparture city (e.g., Moscow, Saint Petersburg, Novosibirsk): ")
-            departure_city = match_city(raw_dep, cities)
+            departure_city = match_city(raw_dep, city_map)
             if not departure_city:
                 print(f"Error: '{raw_dep}' is not in the available cities list.")
                 continue
 
             # Get arrival city
             raw_arr = input("Arrival city (e.g., Moscow, Saint Petersburg, Novosibirsk): ")
-            arrival_city = match_city(raw_arr, cities)
+            arrival_city = match_city(raw_arr, city_map)
             if not arrival_city:
                 print(f"Error: '{raw_arr}' is not in the available cities list.")
                 continue
@@ -115,8 +234,9 @@ def get_user_input(cities):
 
             # Parse date and time
             try:
-                departure_time = pd.Timestamp(f"{date_str} {time_str}").tz_localize('UTC+03:00')
-            except:
+                departure_time = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+                departure_time = pd.Timestamp(departure_time).tz_localize('UTC+03:00')
+            except ValueError:
                 print("Invalid date or time format. Please use YYYY-MM-DD for date and HH:MM for time.")
                 continue
 
@@ -128,10 +248,20 @@ def get_user_input(cities):
             sys.exit(0)
 
 
+def format_price(price):
+    """
+    Format a price for display; flights without a fare (NaN) show as 'price unknown'.
+
+    >>> format_price(250), format_price(float('nan'))
+    ('250.00', 'price unknown')
+    """
+    return 'price unknown' if pd.isna(price) else f"{price:.2f}"
+
+
 def display_route(route_type, route_details):
     """Display a single route with all details."""
     print(f"\n{route_type.upper()} ROUTE:")
-    print(f"  Total price: {route_details['total_price']:.2f}")
+    print(f"  Total price: {format_price(route_details['total_price'])}")
     # Format duration into hours and minutes
     td = route_details['total_duration']
     total_seconds = td.total_seconds()
@@ -147,7 +277,7 @@ def display_route(route_type, route_details):
         arr = segment['arrival'].strftime('%Y-%m-%d %H:%M')
         print(f"     Departure: {dep}")
         print(f"     Arrival: {arr}")
-        print(f"     Price: {segment['price']:.2f}")
+        print(f"     Price: {format_price(segment['price'])}")
 
 
 def display_results(best_routes):
@@ -170,33 +300,24 @@ def main():
     args = parse_arguments()
 
     # Load and preprocess flight data
-    df, city_airports = load_and_preprocess_data(args.data)
+    df, city_airports = load_and_preprocess_data(args.data, args.fast_io)
 
-    while True:
-        # Get list of cities
-        cities = get_cities_list(city_airports)
+    # Build the flight graph and city lookup once; each search only filters the graph by time
+    flight_graph = build_flight_graph_full(df)
+    city_map = build_city_map(get_cities_list(city_airports))
 
+    while True:
         # Get user input
-        departure_city, arrival_city, departure_time = get_user_input(cities)
+        departure_city, arrival_city, departure_time = get_user_input(city_map)
 
         print(f"\nSearching for routes from {departure_city} to {arrival_city} on {departure_time}...")
 
-        # Build flight graph
-        flight_graph, airport_nodes = build_flight_graph(df, departure_time)
+        # Keep only flights departing after the requested time
+        query_graph = filter_edges_by_time(flight_graph, departure_time)
 
-        # Find all possible paths
+        # Search the cheapest, fastest and least-transfers routes with A*
         try:
-            paths = find_all_paths(flight_graph, city_airports, departure_city, arrival_city)
-
-            # Get detailed information for each path
-            path_details = []
-            for path in paths:
-                details = get_path_details(flight_graph, path)
-                if details:
-                    path_details.append(details)
-
-            # Select the best routes
-            best_routes = select_best_routes(path_details)
+            best_routes = find_best_routes(query_graph, city_airports, departure_city, arrival_city)
 
             # Display results
             display_results(best_routes)
@@ -3,6 +3,10 @@ Flight ticket summary extraction module.
 
 This module loads flight schedule and fare data from a SQLite database, merges
 them into a consolidated DataFrame, and writes the result out as a CSV file.
+The command-line entry point streams the query result to the CSV in chunks, so
+memory use does not grow with the size of the database.
+City names and coordinates are already parsed in SQL, so the preprocessing
+module skips extract_city_names and extract_coordinates for this output.
 """
 
 import sqlite3
@@ -16,27 +20,85 @@ db_file = os.path.abspath(os.path.join(script_dir, os.pardir, 'data', 'travel.sq
 output_dir = os.path.abspath(os.path.join(script_dir, os.pardir, 'data', 'processed'))
 output_csv_file = os.path.join(output_dir, 'flight_ticket_summary.csv')
 
-# --- SQL query ---
-sql_select_summary = """
-WITH table1 AS (
+# Rows fetched from SQLite and written to the CSV at a time
+CHUNK_SIZE = 50_000
+
+# Connection settings for the one-off export: a 64 MiB page cache (negative values are KiB),
+# in-memory temporary tables for the GROUP BY and joins, and up to 256 MiB of memory-mapped I/O
+SQLITE_PRAGMAS = (
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+)
+
+# Optional index for the summary query (--create-indexes): a covering index lets table2
+# group ticket_flights in index order instead of sorting it in a temporary B-tree.
+# ANALYZE gives the query planner statistics to use it. Both write to the database file.
+SQLITE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_ticket_flights_flight ON ticket_flights(flight_id, fare_conditions, amount);
+ANALYZE;
+"""
+
+
+def prepare_connection(conn: sqlite3.Connection, create_indexes: bool = False) -> None:
+    """
+    Apply SQLITE_PRAGMAS (connection-only, nothing is written) on an open connection and, if
+    asked, create the SQLITE_INDEXES index. Index creation is best-effort: on a read-only
+    database it is skipped with a warning and the query runs unindexed.
+
+    :param conn: Connection to the travel database.
+           create_indexes: Create the covering index and run ANALYZE, which modifies the database file.
+    """
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    if not create_indexes:
+        return
+    try:
+        conn.executescript(SQLITE_INDEXES)
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        print(f"Warning: could not create indexes ({e}); querying without them.")
+
+# --- SQL queries ---
+# Flights with their airports' city names and coordinates, shared by both queries below
+sql_flight_ctes = """
+WITH airports AS (
+    -- Parse each airport once: English city name from the JSON city column and
+    -- longitude/latitude from the '(lon,lat)' coordinates string
+    SELECT
+        airport_code,
+        json_extract(city, '$.en') AS city_name,
+        CAST(substr(coordinates, 2, instr(coordinates, ',') - 2) AS REAL) AS longitude,
+        CAST(substr(coordinates, instr(coordinates, ',') + 1,
+                    length(coordinates) - instr(coordinates, ',') - 1) AS REAL) AS latitude
+    FROM
+        airports_data
+),
+table1 AS (
     SELECT
         f.flight_id,
         f.flight_no,
         f.scheduled_departure,
         f.scheduled_arrival,
         f.departure_airport,
-        dep_air.city AS departure_city,
-        dep_air.coordinates AS departure_coordinates,
+        dep_air.city_name AS departure_city_name,
+        dep_air.longitude AS departure_longitude,
+        dep_air.latitude AS departure_latitude,
         f.arrival_airport,
-        arr_air.city AS arrival_city,
-        arr_air.coordinates AS arrival_coordinates
+        arr_air.city_name AS arrival_city_name,
+        arr_air.longitude AS arrival_longitude,
+        arr_air.latitude AS arrival_latitude
     FROM
         flights AS f
     LEFT JOIN
-        airports_data AS dep_air ON f.departure_airport = dep_air.airport_code
+        airports AS dep_air ON f.departure_airport = dep_air.airport_code
     LEFT JOIN
-        airports_data AS arr_air ON f.arrival_airport = arr_air.airport_code
-),
+        airports AS arr_air ON f.arrival_airport = arr_air.airport_code
+)
+"""
+
+# One row per (flight, fare class, price) with the number of tickets sold
+sql_select_summary = sql_flight_ctes + """,
 table2 AS (
     SELECT
         flight_id,
@@ -61,12 +123,36 @@ ON
     t1.flight_id = t2.flight_id;
 """
 
-def load_data(db_file: str, sql: str) -> pd.DataFrame:
+# One row per flight with its cheapest fare, all the route search needs: the graph keeps a
+# single price per flight, so the per-fare rows of the summary only multiply the file size
+sql_select_routing = sql_flight_ctes + """,
+table2 AS (
+    SELECT
+        flight_id,
+        MIN(amount) AS amount
+    FROM
+        ticket_flights
+    GROUP BY
+        flight_id
+)
+SELECT
+    t1.*,
+    t2.amount
+FROM
+    table1 AS t1
+LEFT JOIN
+    table2 AS t2
+ON
+    t1.flight_id = t2.flight_id;
+"""
+
+def load_data(db_file: str, sql: str, create_indexes: bool = False) -> pd.DataFrame:
     """
     Load and merge flight schedule and fare data from a SQLite database.
 
     :param db_file: Path to the SQLite database file.
            sql: SQL query string using CTEs to join flight and fare tables.
+           create_indexes: Create SQLITE_INDEXES in the database first (see prepare_connection).
 
     :return DataFrame: Merged DataFrame containing flight schedule and fare summary.
 
@@ -78,6 +164,7 @@ def load_data(db_file: str, sql: str) -> pd.DataFrame:
         sys.exit(1)
     try:
         with sqlite3.connect(db_file) as conn:
+            prepare_connection(conn, create_indexes)
             df = pd.read_sql_query(sql, conn)
     except sqlite3.Error as e:
         print(f"Error querying database: {e}")
@@ -85,6 +172,89 @@ def load_data(db_file: str, sql: str) -> pd.DataFrame:
     print(f"Successfully loaded {len(df)} rows.")
     return df
 
+def _parquet_schema(columns=None):
+    """
+    Arrow schema of the summary query result, or of the given subset of its columns (e.g. the
+    routing query). Fixed up front so that every streamed chunk becomes a row group of the
+    same schema, whatever pandas infers for an individual chunk.
+    """
+    import pyarrow as pa
+    string_cols = ['flight_no', 'scheduled_departure', 'scheduled_arrival',
+                   'departure_airport', 'departure_city_name', 'arrival_airport', 'arrival_city_name',
+                   'fare_conditions']
+    double_cols = ['departure_longitude', 'departure_latitude', 'arrival_longitude', 'arrival_latitude',
+                   'amount', 'ticket_count']
+    column_order = ['flight_id', 'flight_no', 'scheduled_departure', 'scheduled_arrival',
+                    'departure_airport', 'departure_city_name', 'departure_longitude', 'departure_latitude',
+                    'arrival_airport', 'arrival_city_name', 'arrival_longitude', 'arrival_latitude',
+                    'fare_conditions', 'amount', 'ticket_count']
+    types = {'flight_id': pa.int64(), **{c: pa.string() for c in string_cols}, **{c: pa.float64() for c in double_cols}}
+    return pa.schema([(col, types[col]) for col in column_order if columns is None or col in columns])
+
+def export_data(db_file: str, sql: str, output_file: str, chunksize: int = CHUNK_SIZE,
+                create_indexes: bool = False) -> int:
+    """
+    Stream the query result from a SQLite database straight into a CSV file, or a Parquet file
+    if output_file ends in '.parquet', chunksize rows at a time, instead of loading the whole
+    join into memory first. Parquet output (zstd-compressed, one row group per chunk) needs pyarrow.
+
+    :param db_file: Path to the SQLite database file.
+           sql: SQL query string using CTEs to join flight and fare tables.
+           output_file: Path where the CSV or Parquet file will be written.
+           chunksize: Number of rows fetched and written per chunk.
+           create_indexes: Create SQLITE_INDEXES in the database first (see prepare_connection).
+
+    :return int: Number of rows written.
+
+    Raises: SystemExit: If the database file is missing, a database error occurs,
+            pyarrow is missing for Parquet output, or directory creation or file write fails.
+    """
+    # Ensure database file exists
+    if not os.path.exists(db_file):
+        print(f"Error: Database file '{db_file}' not found.")
+        sys.exit(1)
+
+    parquet = output_file.endswith('.parquet')
+    if parquet:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("Error: writing Parquet requires pyarrow; install it or use a .csv output file.")
+            sys.exit(1)
+
+    n_rows = 0
+    writer = None
+    try:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        print(f"Streaming query result to {'Parquet' if parquet else 'CSV'} file: '{output_file}'...")
+        with sqlite3.connect(db_file) as conn:
+            prepare_connection(conn, create_indexes)
+            for chunk in pd.read_sql_query(sql, conn, chunksize=chunksize):
+                if parquet:
+                    table = pa.Table.from_pandas(chunk, schema=_parquet_schema(chunk.columns),
+                                                 preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_file, table.schema, compression='zstd')
+                    writer.write_table(table)
+                else:
+                    # The first chunk creates the file with the header, the rest are appended
+                    first = n_rows == 0
+                    chunk.to_csv(output_file, index=False, encoding='utf-8',
+                                 mode='w' if first else 'a', header=first)
+                n_rows += len(chunk)
+    except sqlite3.Error as e:
+        print(f"Error querying database: {e}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"Error saving output file: {e}")
+        sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f"Successfully saved {n_rows} rows to '{output_file}'.")
+    return n_rows
+
 def save_data(df: pd.DataFrame, output_file: str) -> None:
     """
     Save the merged flight summary DataFrame to a CSV file.
@@ -108,31 +278,30 @@ def save_data(df: pd.DataFrame, output_file: str) -> None:
 
 def main():
     """
-    Command-line entry point: loads data from SQLite and writes summary to CSV.
-    Uses argparse to parse --db-file and --output-file arguments.
+    Command-line entry point: streams the summary from SQLite to CSV.
+    Uses argparse to parse --db-file, --output-file, --chunksize, --routing and --create-indexes arguments.
     """
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Load flight ticket summary from SQLite and save to CSV.")
     parser.add_argument("--db-file", default=db_file, help="Path to the SQLite database file.")
-    parser.add_argument("--output-file", default=output_csv_file, help="Path to the output CSV file.")
+    parser.add_argument("--output-file", default=output_csv_file,
+                        help="Path to the output file; a '.parquet' extension writes Parquet instead of CSV.")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="Rows fetched and written per chunk.")
+    parser.add_argument("--routing", action="store_true",
+                        help="Write one row per flight with its cheapest fare instead of one row per fare.")
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="Add a covering index and ANALYZE statistics to the database to speed up the "
+                             "query (modifies the database file).")
     args = parser.parse_args()
 
-    # Load data from database
-    try:
-        df = load_data(args.db_file, sql_select_summary)
-    except SystemExit:
-        sys.exit(1)
-    except Exception as e:
-        print(f"Unexpected error during data loading: {e}")
-        sys.exit(1)
-
-    # Save data to CSV
+    # Stream data from the database to CSV
+    sql = sql_select_routing if args.routing else sql_select_summary
     try:
-        save_data(df, args.output_file)
+        export_data(args.db_file, sql, args.output_file, args.chunksize, args.create_indexes)
     except SystemExit:
         sys.exit(1)
     except Exception as e:
-        print(f"Unexpected error during data saving: {e}")
+        print(f"Unexpected error during data export: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -5,17 +5,34 @@ This module provides functionality to build flight networks and
 find paths based on different criteria using a functional approach.
 """
 
+import heapq
+import itertools
+import math
 import networkx as nx
+import numpy as np
 from datetime import timedelta
 import pandas as pd
 
 
-def build_flight_graph(flights_df, departure_time):
+EARTH_RADIUS_KM = 6371.0
+
+# Cost each route type is optimised for by astar_route
+ROUTE_WEIGHTS = {
+    'cheapest': 'price',
+    'fastest': 'duration',
+    'least_transfers': 'transfers'
+}
+
+
+def build_flight_graph(flights_df, departure_time, presorted=False):
     """
     Build a directed graph of flights that occur after the specified departure time.
 
     :param flights_df: DataFrame, preprocessed flight data
            departure_time: datetime, the earliest time a passenger can depart
+           presorted: bool, default=False, set when flights_df is sorted by scheduled_departure
+                      (e.g. by sort_by_departure, once at load time); the time filter is then a
+                      binary search and a slice instead of a comparison over every row
     :return tuple: (networkx. MultiDiGraph, set of airport nodes)
 
     >>> data = {
@@ -35,49 +52,231 @@ def build_flight_graph(flights_df, departure_time):
     2
     >>> 'SVO' in airport_nodes
     True
+    >>> G, _ = build_flight_graph(sort_by_departure(df), pd.Timestamp('2023-01-01 12:00:00'), presorted=True)
+    >>> list(G.edges())
+    [('LED', 'SVO')]
+    """
+    # Filter flights by scheduled departure time, comparing int64 nanoseconds
+    departure_ns = pd.Timestamp(departure_time).value
+    if presorted:
+        start = np.searchsorted(_departure_ns(flights_df), departure_ns, side='left')
+        valid_flights = flights_df.iloc[start:]
+    else:
+        valid_flights = flights_df[_departure_ns(flights_df) >= departure_ns]
+
+    G = build_flight_graph_full(valid_flights)
+    return G, set(G.nodes)
+
+
+def sort_by_departure(flights_df):
+    """
+    Return flights_df sorted by scheduled departure, for build_flight_graph(..., presorted=True).
+    The sort is stable, so rows of the same flight keep their order (the last one still wins).
+    """
+    order = np.argsort(_departure_ns(flights_df), kind='stable')
+    return flights_df.iloc[order]
+
+
+def build_flight_graph_full(flights_df):
+    """
+    Build a directed graph of all flights. Meant to be built once per dataset and
+    narrowed per query with filter_edges_by_time.
+
+    :param flights_df: DataFrame, preprocessed flight data
+    :return: networkx.MultiDiGraph with one edge per flight
+
+    >>> df = pd.DataFrame({
+    ...     'flight_id': ['11', '12'],
+    ...     'flight_no': ['PG1234', 'PG5678'],
+    ...     'departure_airport': ['SVO', 'LED'],
+    ...     'arrival_airport': ['LED', 'SVO'],
+    ...     'scheduled_departure': [pd.Timestamp('2023-01-01 10:00:00'), pd.Timestamp('2023-01-01 14:00:00')],
+    ...     'scheduled_arrival':   [pd.Timestamp('2023-01-01 12:00:00'), pd.Timestamp('2023-01-01 16:00:00')],
+    ...     'flight_duration_hours': [2.0, 2.25],
+    ...     'amount': [100, 120]
+    ... })
+    >>> G = build_flight_graph_full(df)
+    >>> sorted(G.edges(keys=True))
+    [('LED', 'SVO', '12'), ('SVO', 'LED', '11')]
     """
     # Create a new directed graph
     G = nx.MultiDiGraph()
-    airport_nodes = set()
-
-    # Filter flights by scheduled departure time
-    if not isinstance(departure_time, pd.Timestamp):
-        departure_time = pd.Timestamp(departure_time)
-    valid_flights = flights_df[flights_df['scheduled_departure'] >= departure_time]
-
-    # Create edges for each valid flight
-    for _, flight in valid_flights.iterrows():
-        departure_airport = flight['departure_airport']
-        arrival_airport = flight['arrival_airport']
-
-        # Store airport nodes for later reference
-        airport_nodes.add(departure_airport)
-        airport_nodes.add(arrival_airport)
-
-        # Add nodes if they don't exist
-        if not G.has_node(departure_airport):
-            G.add_node(departure_airport, type='airport')
-
-        if not G.has_node(arrival_airport):
-            G.add_node(arrival_airport, type='airport')
-
-        # Extract attributes for this flight edge
-        edge_attrs = {
-            'flight_id': flight['flight_id'],
-            'flight_number': flight['flight_no'],
-            'scheduled_departure': flight['scheduled_departure'],
-            'scheduled_arrival': flight['scheduled_arrival'],
-            'duration_hours': flight['flight_duration_hours'],
-            'price': flight['amount']
-        }
 
-        # Add edge with flight attributes
-        G.add_edge(departure_airport, arrival_airport, key=flight['flight_id'], **edge_attrs)
+    # Pull each column out once as a list of Python scalars (Timestamps for the times)
+    # instead of materializing a Series per row
+    departure_airports = flights_df['departure_airport'].tolist()
+    arrival_airports = flights_df['arrival_airport'].tolist()
+    departure_coords = _coordinate_columns(flights_df, 'departure')
+    arrival_coords = _coordinate_columns(flights_df, 'arrival')
+
+    # Add every airport once, in order of first appearance, with the coordinates of the row it
+    # first appears in (for the A* heuristic). Interleaving departure and arrival codes
+    # (dep0, arr0, dep1, arr1, ...) lets np.unique find those first appearances in one pass
+    interleaved = np.empty(2 * len(departure_airports), dtype=object)
+    interleaved[0::2] = departure_airports
+    interleaved[1::2] = arrival_airports
+    _, first_positions = np.unique(interleaved, return_index=True)
+    G.add_nodes_from(
+        (interleaved[pos], {'type': 'airport',
+                            **_airport_coordinates(arrival_coords if pos % 2 else departure_coords, pos // 2)})
+        for pos in np.sort(first_positions).tolist()
+    )
+
+    # Create edges for each flight, keyed by flight_id, in one batch
+    flight_ids = flights_df['flight_id'].tolist()
+    columns = zip(
+        departure_airports,
+        arrival_airports,
+        flight_ids,
+        flights_df['flight_no'].tolist(),
+        flights_df['scheduled_departure'].tolist(),
+        flights_df['scheduled_arrival'].tolist(),
+        _departure_ns(flights_df).tolist(),
+        _arrival_ns(flights_df).tolist(),
+        flights_df['flight_duration_hours'].tolist(),
+        flights_df['amount'].tolist()
+    )
+    G.add_edges_from(
+        (departure_airport, arrival_airport, flight_id, {
+            'flight_id': flight_id,
+            'flight_number': flight_no,
+            'scheduled_departure': departure,
+            'scheduled_arrival': arrival,
+            'departure_ns': departure_ns,
+            'arrival_ns': arrival_ns,
+            'duration_hours': duration_hours,
+            'price': price
+        })
+        for (departure_airport, arrival_airport, flight_id, flight_no,
+             departure, arrival, departure_ns, arrival_ns, duration_hours, price) in columns
+    )
+
+    # Compute the distance matrix, A* heuristic rates and departure index over all flights now:
+    # views made by filter_edges_by_time share G.graph, so they reuse these (the bounds stay admissible)
+    _heuristic_rates(G)
+    G.graph['departures'] = _departure_index(G)
+    G.graph['sorted_edges'] = _sorted_edge_bundles(G)
+
+    return G
 
-    return G, airport_nodes
 
+def _to_ns(times):
+    """Convert a datetime Series (tz-aware or naive) to int64 nanoseconds."""
+    return pd.DatetimeIndex(times).as_unit('ns').asi8
 
-def find_all_paths(G, city_to_airports_map, departure_city, arrival_city, max_segments=3):
+
+def _departure_ns(flights_df):
+    """Scheduled departures as an int64 nanosecond array, from the dep_ns column when present."""
+    if 'dep_ns' in flights_df.columns:
+        return flights_df['dep_ns'].to_numpy(dtype=np.int64)
+    return _to_ns(flights_df['scheduled_departure'])
+
+
+def _arrival_ns(flights_df):
+    """Scheduled arrivals as an int64 nanosecond array, from the arr_ns column when present."""
+    if 'arr_ns' in flights_df.columns:
+        return flights_df['arr_ns'].to_numpy(dtype=np.int64)
+    return _to_ns(flights_df['scheduled_arrival'])
+
+
+def _flight_ns(flight_data):
+    """
+    (departure, arrival) of a flight edge as int64 nanoseconds, from the departure_ns/arrival_ns
+    attributes set by build_flight_graph_full, else from the Timestamps of a hand-built edge.
+    """
+    departure_ns = flight_data.get('departure_ns')
+    if departure_ns is None:
+        departure_ns = flight_data['scheduled_departure'].value
+    arrival_ns = flight_data.get('arrival_ns')
+    if arrival_ns is None:
+        arrival_ns = flight_data['scheduled_arrival'].value
+    return departure_ns, arrival_ns
+
+
+def _departure_index(G):
+    """
+    Per airport, its outgoing flights sorted by departure time:
+    (int64 ns departure times, [(neighbor, flight_data), ...] in the same order).
+    A search finds the flights leaving at or after a time with one np.searchsorted.
+    """
+    index = {}
+    for airport in G.nodes:
+        flights = [(neighbor, flight_data)
+                   for neighbor, edge_dict in G.adj[airport].items()
+                   for flight_data in edge_dict.values()]
+        flights.sort(key=lambda item: item[1]['departure_ns'])
+        dep_ns = np.array([flight_data['departure_ns'] for _, flight_data in flights], dtype=np.int64)
+        index[airport] = (dep_ns, flights)
+    return index
+
+
+def _sorted_edge_bundles(G):
+    """
+    Per (origin, destination) airport pair, its flights sorted by departure time as parallel arrays:
+    (departure ns, arrival ns, price, flight hours, [flight_data, ...]). _leg_bounds finds the
+    flights after a given arrival with one np.searchsorted and reduces over array slices.
+    Built from the departure index, whose per-airport lists are already in departure order.
+    """
+    bundles = {}
+    for origin, (_, flights) in G.graph['departures'].items():
+        for dest, flight_data in flights:
+            bundles.setdefault((origin, dest), []).append(flight_data)
+
+    for pair, flights in bundles.items():
+        bundles[pair] = (
+            np.array([flight_data['departure_ns'] for flight_data in flights], dtype=np.int64),
+            np.array([flight_data['arrival_ns'] for flight_data in flights], dtype=np.int64),
+            np.array([flight_data['price'] for flight_data in flights], dtype=np.float64),
+            np.array([(flight_data['scheduled_arrival'] - flight_data['scheduled_departure']).total_seconds() / 3600
+                      for flight_data in flights], dtype=np.float64),
+            flights
+        )
+    return bundles
+
+
+def filter_edges_by_time(G, departure_time):
+    """
+    Read-only view of a flight graph keeping only flights that depart at or after departure_time.
+    Setting up the view is O(1); edges are filtered lazily while the graph is searched.
+
+    :param G: networkx.MultiDiGraph, flight graph from build_flight_graph_full function
+           departure_time: datetime, the earliest time a passenger can depart
+    :return: networkx.MultiDiGraph view
+
+    >>> G = nx.MultiDiGraph()
+    >>> _ = G.add_edge('SVO', 'LED', departure_ns=pd.Timestamp('2023-01-01 10:00').value)
+    >>> _ = G.add_edge('LED', 'SVO', departure_ns=pd.Timestamp('2023-01-01 14:00').value)
+    >>> list(filter_edges_by_time(G, '2023-01-01 12:00').edges())
+    [('LED', 'SVO')]
+    """
+    # Edges carry their departure as int64 ns, so each check is a plain integer compare
+    departure_ns = pd.Timestamp(departure_time).value
+
+    def departs_in_time(u, v, k):
+        return G[u][v][k]['departure_ns'] >= departure_ns
+
+    return nx.subgraph_view(G, filter_edge=departs_in_time)
+
+
+def _coordinate_columns(flights_df, prefix):
+    """(longitudes, latitudes) lists of one end of the flights, or None if the frame has no coordinates."""
+    lon_col, lat_col = f'{prefix}_longitude', f'{prefix}_latitude'
+    if lon_col not in flights_df.columns or lat_col not in flights_df.columns:
+        return None
+    return flights_df[lon_col].tolist(), flights_df[lat_col].tolist()
+
+
+def _airport_coordinates(coords, i):
+    """Return the longitude/latitude node attributes of row i from _coordinate_columns, if known."""
+    if coords is None:
+        return {}
+    lon, lat = coords[0][i], coords[1][i]
+    if lon is None or lat is None or pd.isna(lon) or pd.isna(lat):
+        return {}
+    return {'longitude': float(lon), 'latitude': float(lat)}
+
+
+def find_all_paths(G, city_to_airports_map, departure_city, arrival_city, max_segments=3, prune=False):
     """
     Find all possible paths from origin city to destination city.
 
@@ -86,8 +285,13 @@ def find_all_paths(G, city_to_airports_map, departure_city, arrival_city, max_se
            departure_city: str, origin city
            arrival_city: str, destination city
            max_segments: int, default=3, Maximum number of flight segments to consider
+           prune: bool, default=False, cut branches that cannot beat the best route found so far
+                  on price, flight time or transfers (branch and bound). The result then still
+                  contains the routes select_best_routes would pick, but not every path.
 
-    :return: List of valid paths, where each path is a list of flight edges
+    :return: Iterator over the valid paths, each a list of airport codes. Paths are produced
+             lazily while the graph is searched, so they can be scored as they come, e.g.
+             select_best_routes(get_path_details(G, p) for p in find_all_paths(...))
 
     >>> G = nx.MultiDiGraph()
     >>> city_to_airports_map = {'Moscow': ['SVO', 'VKO'], 'St Petersburg': ['LED'], 'Kazan': ['KZN']}
@@ -97,6 +301,13 @@ def find_all_paths(G, city_to_airports_map, departure_city, arrival_city, max_se
     >>> paths = find_all_paths(G, city_to_airports_map, 'Moscow', 'Kazan')
     >>> [p for p in paths]
     [['SVO', 'LED', 'KZN'], ['VKO', 'KZN']]
+    >>> # once the cheaper, faster direct flight is found, the detour through LED is cut
+    >>> G = nx.MultiDiGraph()
+    >>> _ = G.add_edge('SVO', 'KZN', scheduled_departure=pd.Timestamp('2020-01-01 10:00'), scheduled_arrival=pd.Timestamp('2020-01-01 11:00'), price=90)
+    >>> _ = G.add_edge('SVO', 'LED', scheduled_departure=pd.Timestamp('2020-01-01 10:00'), scheduled_arrival=pd.Timestamp('2020-01-01 11:00'), price=100)
+    >>> _ = G.add_edge('LED', 'KZN', scheduled_departure=pd.Timestamp('2020-01-01 12:00'), scheduled_arrival=pd.Timestamp('2020-01-01 13:00'), price=200)
+    >>> list(find_all_paths(G, city_to_airports_map, 'Moscow', 'Kazan', prune=True))
+    [['SVO', 'KZN']]
     """
     if G is None:
         raise ValueError("Flight graph not built")
@@ -114,76 +325,203 @@ def find_all_paths(G, city_to_airports_map, departure_city, arrival_city, max_se
     if not dest_airports:
         raise ValueError(f"No airports found for destination city: {arrival_city}")
 
-    all_paths = []
+    # Lower bounds to the destination and the best (price, hours, transfers) seen so far,
+    # shared by the searches from every origin airport
+    bounds = None
+    reachable_dests = set(dest_airports) & set(G.nodes)
+    if prune and reachable_dests:
+        bounds = {
+            'h_price': _heuristic(G, reachable_dests, 'price'),
+            'h_hours': _heuristic(G, reachable_dests, 'duration'),
+            'best': [math.inf, math.inf, math.inf]
+        }
 
-    # For each origin-destination airport pair
-    for origin_airport in origin_airports:
-        for dest_airport in dest_airports:
-            # Skip if same airport
-            if origin_airport == dest_airport:
-                continue
+    # Backward half of a bidirectional search: how late each airport can be left and still reach
+    # a destination in the remaining hops. The forward DFS below uses it to skip dead branches
+    latest = _latest_departures(G, set(dest_airports), max_segments - 1)
 
-            # Find paths with limited segments
-            for path in _find_time_aware_paths(G, origin_airport, dest_airport, max_segments):
-                all_paths.append(path)
+    # One search per origin airport, each towards the whole set of destination airports, so a
+    # city pair costs k searches rather than k * m. This is what a virtual source/sink pair
+    # would give: simple paths from different origins share no prefix, so a single search from
+    # a super-source would visit exactly the same states.
+    # The checks above run eagerly, the search itself only as the paths are consumed
+    dest_set = set(dest_airports)
+    return itertools.chain.from_iterable(
+        _find_time_aware_paths(G, origin_airport, dest_set - {origin_airport}, max_segments, bounds, latest)
+        for origin_airport in origin_airports
+    )
 
-    return all_paths
 
+def _leg_bounds(edge_dict, last_arrival_ns, bundle=None):
+    """
+    Over the flights of one airport pair that depart after last_arrival_ns (any flight if it
+    is None): earliest arrival (int64 ns), lowest price and shortest flight time in hours.
+    Returns None if there is no such flight.
 
-def _find_time_aware_paths(G, origin_airport, dest_airport, max_segments):
+    With the pair's bundle from _sorted_edge_bundles the flights are found by binary search and
+    reduced as array slices; otherwise every flight in edge_dict is checked.
     """
-    Find all time-constrained paths between two airports.
-    This respects the temporal sequence of flights (connection causality).
+    if bundle is not None and last_arrival_ns is not None:
+        dep_ns, arr_ns, prices, hours, _ = bundle
+        start = np.searchsorted(dep_ns, last_arrival_ns, side='right')
+        if start == len(dep_ns):
+            return None
+        earliest = int(arr_ns[start:].min())
+        # fmin ignores NaN prices; all unknown still bounds the leg by 0
+        min_price = np.fmin.reduce(prices[start:])
+        return earliest, (0 if np.isnan(min_price) else float(min_price)), float(hours[start:].min())
+
+    earliest = None
+    min_price = math.inf
+    min_hours = math.inf
+    for flight_data in edge_dict.values():
+        departure_ns, arrival_ns = _flight_ns(flight_data)
+        if last_arrival_ns is None or departure_ns > last_arrival_ns:
+            if earliest is None or arrival_ns < earliest:
+                earliest = arrival_ns
+            price = flight_data.get('price')
+            if price is not None and not pd.isna(price):
+                min_price = min(min_price, price)
+            min_hours = min(min_hours, (arrival_ns - departure_ns) / 3.6e12)
+    if earliest is None:
+        return None
+    # A leg whose prices are all unknown can still be taken: bound it by 0
+    return earliest, (min_price if min_price < math.inf else 0), min_hours
 
-    :param G: networkx.MultiDiGraph, flight graph from build_flight_graph function
-           origin_airport : str
-           dest_airport : str
-           max_segments : int, maximum number of flight segments
 
-    :return: List of valid paths with flight details
+def _latest_departures(G, dest_airports, max_hops):
     """
-    if not G.has_node(origin_airport) or not G.has_node(dest_airport):
-        return []
-
-    # Use a modified BFS to find valid paths
-    # Asked chatgpt about the BFS algorithm
-    queue = [(origin_airport, [origin_airport], None)]  # (airport, path_so_far, last_arrival_time)
-    valid_paths = []
+    Search backwards from the destinations over the reversed graph with the reversed time
+    constraint. latest[r][airport] is the latest departure (int64 ns) from airport that can still
+    reach a destination within r flights, each one departing after the previous arrives; latest[0] is
+    unused. The visited-airport rule is ignored, so this is an upper bound, which keeps any
+    pruning based on it exact.
 
-    # A state is a combination of (airport, last_arrival_time)
-    visited = set()
+    >>> G = nx.MultiDiGraph()
+    >>> _ = G.add_edge('A', 'B', scheduled_departure=pd.Timestamp('2020-01-01 08:00'), scheduled_arrival=pd.Timestamp('2020-01-01 09:00'))
+    >>> _ = G.add_edge('B', 'C', scheduled_departure=pd.Timestamp('2020-01-01 10:00'), scheduled_arrival=pd.Timestamp('2020-01-01 11:00'))
+    >>> _ = G.add_edge('A', 'B', scheduled_departure=pd.Timestamp('2020-01-01 12:00'), scheduled_arrival=pd.Timestamp('2020-01-01 13:00'))
+    >>> latest = _latest_departures(G, {'C'}, 2)
+    >>> sorted(latest[1]), latest[2]['A'] == pd.Timestamp('2020-01-01 08:00').value
+    (['B'], True)
+    """
+    pred = G.pred
+    latest = [None]
+    for hops in range(1, max_hops + 1):
+        previous = latest[-1] if hops > 1 else {}
+        level = dict(previous)
+        # One more flight into a destination (no time limit there) or into an airport of the
+        # previous level, landing before its latest useful departure
+        targets = [(b, None) for b in dest_airports if b in pred] + list(previous.items())
+        for b, limit in targets:
+            for a, edge_dict in pred[b].items():
+                for flight_data in edge_dict.values():
+                    departure_ns, arrival_ns = _flight_ns(flight_data)
+                    if limit is None or arrival_ns < limit:
+                        if a not in level or departure_ns > level[a]:
+                            level[a] = departure_ns
+        latest.append(level)
+    return latest
+
+
+def _find_time_aware_paths(G, origin_airport, dest_airports, max_segments, bounds=None, latest=None):
+    """
+    Find all time-constrained simple paths from an airport to any of the destination airports.
+    This respects the temporal sequence of flights (connection causality): a leg is only
+    followed if one of its flights departs after the earliest possible arrival so far.
 
-    while queue:
-        current_airport, path_so_far, last_arrival_time = queue.pop(0)
+    :param G: networkx.MultiDiGraph, flight graph from build_flight_graph function
+           origin_airport : str
+           dest_airports : set of str
+           max_segments : int, maximum number of flight segments
+           bounds : dict from find_all_paths when pruning, else None
+           latest : list from _latest_departures (max_segments - 1 hops), to skip legs
+                    after which no destination can be reached in time; None to expand all
 
-        # Create a state identifier for the visited set
-        state = (current_airport, last_arrival_time)
-        if state in visited:
+    :return: Generator of valid paths, each a list of airport codes
+    """
+    if not G.has_node(origin_airport):
+        return
+
+    # Iterator-based DFS: each stack entry holds the airport's remaining neighbours,
+    # path/arrivals hold the current airport sequence and earliest arrival (int64 ns) at each of them,
+    # costs the lower bounds (price, hours) of reaching them
+    adj = G.adj
+    # Sorted flight bundles of the full graph; only used after the first leg, since the bundles
+    # also hold flights that a time-filtered view hides, all of which depart before the first leg
+    bundles = G.graph.get('sorted_edges') or {}
+    path = [origin_airport]
+    arrivals = [None]
+    costs = [(0, 0)]
+    stack = [iter(adj[origin_airport].items())]
+
+    while stack:
+        neighbor, edge_dict = next(stack[-1], (None, None))
+        if edge_dict is None:
+            stack.pop()
+            path.pop()
+            arrivals.pop()
+            costs.pop()
             continue
-        visited.add(state)
 
-        # If we're at destination, add to valid paths
-        if current_airport == dest_airport and path_so_far[0] == origin_airport:
-            valid_paths.append(path_so_far)
+        if neighbor in path:
             continue
 
-        # Skip if path is already at max length and we're not at destination
-        if len(path_so_far) > max_segments:
+        # Meet the backward search: a non-destination must still reach a destination within
+        # the remaining segments, checked before looking at the leg's flights
+        latest_departure = None
+        if neighbor not in dest_airports:
+            if len(path) >= max_segments:
+                continue
+            if latest is not None:
+                latest_departure = latest[max_segments - len(path)].get(neighbor)
+                if latest_departure is None:
+                    continue
+
+        # Check if some flight on this leg departs after the previous arrival
+        leg = _leg_bounds(edge_dict, arrivals[-1], bundles.get((path[-1], neighbor)))
+        if leg is None:
             continue
-
-        # Process MultiDiGraph edges
-        for neighbor, edge_dict in G.adj[current_airport].items():
-            for edge_key, flight_data in edge_dict.items():
-                # Get departure and arrival times
-                departure_time = flight_data.get('scheduled_departure')
-                arrival_time = flight_data.get('scheduled_arrival')
-
-                # Check if this flight departs after previous flight's arrival
-                if last_arrival_time is None or departure_time > last_arrival_time:
-                    new_path = path_so_far + [neighbor]
-                    queue.append((neighbor, new_path, arrival_time))
-
-    return valid_paths
+        arrival_ns, leg_price, leg_hours = leg
+        if latest_departure is not None and arrival_ns >= latest_departure:
+            continue
+        cum_price = costs[-1][0] + leg_price
+        cum_hours = costs[-1][1] + leg_hours
+
+        # If we're at a destination, add to valid paths
+        if neighbor in dest_airports:
+            found = path + [neighbor]
+            if bounds is not None:
+                _update_best(bounds['best'], _path_segments(G, found))
+            yield found
+        else:
+            if bounds is not None:
+                best_price, best_hours, best_transfers = bounds['best']
+                # Any completion has at least one more segment, i.e. len(path) transfers
+                if (cum_price + bounds['h_price'][neighbor] >= best_price
+                        and cum_hours + bounds['h_hours'][neighbor] >= best_hours
+                        and len(path) >= best_transfers):
+                    continue
+            path.append(neighbor)
+            arrivals.append(arrival_ns)
+            costs.append((cum_price, cum_hours))
+            stack.append(iter(adj[neighbor].items()))
+
+
+def _update_best(best, segments):
+    """
+    Lower the best [price, hours, transfers] found so far with a route from _path_segments.
+    Works on the chosen flights directly, without building the route dict.
+    """
+    if segments is None:
+        return
+    total_price = sum(flight['price'] for _, _, flight in segments)
+    if not pd.isna(total_price):
+        best[0] = min(best[0], total_price)
+    total_hours = sum((flight['scheduled_arrival'] - flight['scheduled_departure']).total_seconds()
+                      for _, _, flight in segments) / 3600
+    best[1] = min(best[1], total_hours)
+    best[2] = min(best[2], len(segments) - 1)
 
 
 def get_path_details(G, path, min_layover=timedelta(hours=1)):
@@ -229,10 +567,21 @@ def get_path_details(G, path, min_layover=timedelta(hours=1)):
     >>> get_path_details(G, ['A','B','D']) is None
     True
     """
-    path_segments = []
-    total_price    = 0
-    total_duration = timedelta(0)
-    last_arrival   = None
+    segments = _path_segments(G, path, min_layover)
+    if segments is None:
+        return None
+    return _route_details(segments)
+
+
+def _path_segments(G, path, min_layover=timedelta(hours=1)):
+    """
+    The flights get_path_details picks for an airport path, as (origin, dest, flight_data)
+    tuples, or None if a leg has no valid connecting flight. No route dict is built, so
+    callers that only need totals (e.g. pruning bounds) stay allocation-light.
+    """
+    segments = []
+    ready    = None   # earliest allowed departure of the next leg
+    is_multi = isinstance(G, nx.MultiDiGraph)
 
     # walk through each hop in the given airport list
     # this part got help from ChatGPT
@@ -242,18 +591,13 @@ def get_path_details(G, path, min_layover=timedelta(hours=1)):
             # no flights on this leg
             return None
 
-        # unpack candidates (MultiDiGraph vs DiGraph)
-        if isinstance(G, nx.MultiDiGraph):
-            candidates = [edge for _, edge in data.items()]
-        else:
-            candidates = [data]
+        # unpack candidates (MultiDiGraph vs DiGraph) without copying them into a list
+        candidates = data.values() if is_multi else (data,)
 
-        # pick first flight satisfying layover
+        # pick first flight satisfying layover; first leg has no layover constraint
         chosen = None
         for flight in candidates:
-            dep = flight.get('scheduled_departure')
-            # first leg has no layover constraint
-            if last_arrival is None or dep >= last_arrival + min_layover:
+            if ready is None or flight['scheduled_departure'] >= ready:
                 chosen = flight
                 break
 
@@ -262,38 +606,25 @@ def get_path_details(G, path, min_layover=timedelta(hours=1)):
             return None
 
         # record this segment
-        arr = chosen.get('scheduled_arrival')
-        dur = arr - dep
-        path_segments.append({
-            'from':      origin,
-            'to':        dest,
-            'departure': dep,
-            'arrival':   arr,
-            'price':     chosen['price']
-        })
-        total_price    += chosen['price']
-        total_duration += dur
-        last_arrival    = arr
+        segments.append((origin, dest, chosen))
+        ready = chosen['scheduled_arrival'] + min_layover
 
-    return {
-        'path':           path_segments,
-        'total_price':    total_price,
-        'total_duration': total_duration,
-        'transfers':      len(path) - 2
-    }
+    return segments
 
 
 def select_best_routes(all_path_details):
     """
-    Select three optimal routes from a list of path detail dicts:
+    Select three optimal routes from path detail dicts, in a single streaming pass:
       cheapest: the route with minimal total_price
       fastest: the route with minimal total_duration
       least_transfers: the route with minimal transfers
 
-    :param all_path_details: list of dicts, each dict must contain keys:
-                             'path', 'total_price', 'total_duration', 'transfers'
+    :param all_path_details: iterable (list or generator) of dicts, each dict must contain keys:
+                             'path', 'total_price', 'total_duration', 'transfers';
+                             None entries (paths without valid connections) are skipped
     :return: dict with keys 'cheapest', 'fastest', 'least_transfers',
              each mapping to one of the input dicts. Returns None if input is empty.
+             As in find_best_routes, 'cheapest' is left out when no route has a price.
 
     >>> paths = [
     ...     {'path': [], 'total_price': 100, 'total_duration': timedelta(hours=2),    'transfers': 1},
@@ -307,19 +638,371 @@ def select_best_routes(all_path_details):
     datetime.timedelta(seconds=5400)
     >>> best['least_transfers']['transfers']
     0
+    >>> sorted(select_best_routes([{'path': [], 'total_price': float('nan'),
+    ...                             'total_duration': timedelta(hours=1), 'transfers': 0}]))
+    ['fastest', 'least_transfers']
+    >>> select_best_routes(iter([None])) is None
+    True
     """
-    if not all_path_details:
+    details_iter = (details for details in all_path_details if details is not None)
+    first = next(details_iter, None)
+    if first is None:
         return None
 
-    # cheapest by price
-    cheapest = min(all_path_details, key=lambda x: x['total_price'])
-    # fastest by duration
-    fastest = min(all_path_details, key=lambda x: x['total_duration'])
-    # fewest transfers
-    least_transfers = min(all_path_details, key=lambda x: x['transfers'])
-
-    return {
+    # One pass tracking all three minima; ties keep the first route, as min() would.
+    # Routes without a price never become the cheapest
+    fastest = least_transfers = first
+    cheapest = None if pd.isna(first['total_price']) else first
+    for details in details_iter:
+        price = details['total_price']
+        if not pd.isna(price) and (cheapest is None or price < cheapest['total_price']):
+            cheapest = details
+        if details['total_duration'] < fastest['total_duration']:
+            fastest = details
+        if details['transfers'] < least_transfers['transfers']:
+            least_transfers = details
+
+    best = {
         'cheapest': cheapest,
         'fastest': fastest,
         'least_transfers': least_transfers
-    }
\ No newline at end of file
+    }
+    return {key: route for key, route in best.items() if route is not None}
+
+def haversine_distance(lon1, lat1, lon2, lat2):
+    """
+    Great-circle distance in kilometres between two (longitude, latitude) points.
+
+    >>> haversine_distance(37.6, 55.75, 37.6, 55.75)
+    0.0
+    >>> round(haversine_distance(37.62, 55.75, 30.31, 59.94))
+    635
+    """
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_matrix(lon, lat):
+    """
+    Great-circle distances in kilometres between all pairs of (longitude, latitude) points,
+    computed with NumPy broadcasting; same formula as haversine_distance.
+
+    >>> haversine_matrix(np.array([37.62, 30.31]), np.array([55.75, 59.94])).round()
+    array([[  0., 635.],
+           [635.,   0.]])
+    """
+    lon, lat = np.radians(lon), np.radians(lat)
+    a = (np.sin((lat[:, None] - lat[None, :]) / 2) ** 2
+         + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin((lon[:, None] - lon[None, :]) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _distance_matrix(G):
+    """
+    (airport -> row index, matrix of distances in km between all airports of G), computed
+    once and cached on the graph so the heuristics look distances up instead of recomputing
+    the trigonometry. None when some airport has no coordinates. The cache is keyed on the
+    node set, so adding an airport rebuilds it (and the heuristic rates derived from it).
+
+    >>> G = nx.MultiDiGraph()
+    >>> G.add_node('SVO', longitude=37.41, latitude=55.97)
+    >>> G.add_node('LED', longitude=30.26, latitude=59.80)
+    >>> sorted(_distance_matrix(G)[0])
+    ['LED', 'SVO']
+    >>> G.add_node('AER', longitude=39.96, latitude=43.45)
+    >>> sorted(_distance_matrix(G)[0])
+    ['AER', 'LED', 'SVO']
+    """
+    nodes = frozenset(G)
+    cached = G.graph.get('distances')
+    if cached is None or cached[0] != nodes:
+        distances = None
+        node_attrs = list(G.nodes(data=True))
+        if all('longitude' in attrs for _, attrs in node_attrs):
+            airport_idx = {airport: i for i, (airport, _) in enumerate(node_attrs)}
+            lon = np.array([attrs['longitude'] for _, attrs in node_attrs], dtype=np.float64)
+            lat = np.array([attrs['latitude'] for _, attrs in node_attrs], dtype=np.float64)
+            distances = (airport_idx, haversine_matrix(lon, lat))
+        cached = G.graph['distances'] = (nodes, distances)
+        G.graph.pop('heuristic_rates', None)
+    return cached[1]
+
+
+def _segment_cost(flight, weight):
+    """Cost of taking one flight under the given A* weight."""
+    if weight == 'price':
+        return flight['price']
+    if weight == 'duration':
+        return (flight['scheduled_arrival'] - flight['scheduled_departure']).total_seconds() / 3600
+    return 1
+
+
+def _heuristic_rates(G):
+    """
+    Lowest price per km and highest speed (km/h) over every flight in G.
+    Cached on the graph so repeated searches only scan the edges once.
+    Returns None when some airport has no coordinates, since no bound is then admissible.
+    """
+    distances = _distance_matrix(G)
+    if 'heuristic_rates' not in G.graph:
+        rates = None
+        if distances is not None:
+            airport_idx, matrix = distances
+            min_price_per_km = math.inf
+            max_speed = 0.0
+            for u, v, flight in G.edges(data=True):
+                distance = matrix[airport_idx[u], airport_idx[v]]
+                hours = _segment_cost(flight, 'duration')
+                if distance <= 0:
+                    min_price_per_km = 0.0
+                    continue
+                if not pd.isna(flight['price']):
+                    min_price_per_km = min(min_price_per_km, flight['price'] / distance)
+                max_speed = max(max_speed, distance / hours if hours > 0 else math.inf)
+            if math.isinf(min_price_per_km):
+                min_price_per_km = 0.0
+            rates = (min_price_per_km, max_speed)
+        G.graph['heuristic_rates'] = rates
+    return G.graph['heuristic_rates']
+
+
+def _heuristic(G, dest_airports, weight):
+    """
+    Admissible, consistent lower bound on the remaining cost from every airport in G:
+    great-circle distance to the nearest destination airport, scaled by the cheapest
+    price per km (price) or the fastest speed (duration); 1 hop for transfers.
+    """
+    if weight == 'transfers':
+        return {a: 0 if a in dest_airports else 1 for a in G.nodes}
+
+    rates = _heuristic_rates(G)
+    if rates is None:
+        return {a: 0 for a in G.nodes}
+
+    # Distance from every airport to its nearest destination: one column gather and row min
+    min_price_per_km, max_speed = rates
+    airport_idx, matrix = _distance_matrix(G)
+    distance = matrix[:, [airport_idx[d] for d in dest_airports]].min(axis=1)
+    if weight == 'price':
+        bound = distance * min_price_per_km
+    elif max_speed > 0:
+        bound = distance / max_speed
+    else:
+        bound = np.zeros_like(distance)
+    return dict(zip(airport_idx, bound.tolist()))
+
+
+def _route_details(segments):
+    """
+    Build the route dict used by get_path_details and astar_route from a
+    sequence of (origin, destination, flight) segments.
+    """
+    path_segments = []
+    total_price = 0
+    total_duration = timedelta(0)
+    for origin, dest, flight in segments:
+        dep = flight['scheduled_departure']
+        arr = flight['scheduled_arrival']
+        path_segments.append({
+            'from':      origin,
+            'to':        dest,
+            'departure': dep,
+            'arrival':   arr,
+            'price':     flight['price']
+        })
+        total_price    += flight['price']
+        total_duration += arr - dep
+
+    return {
+        'path':           path_segments,
+        'total_price':    total_price,
+        'total_duration': total_duration,
+        'transfers':      len(segments) - 1
+    }
+
+
+def astar_route(G, city_to_airports_map, departure_city, arrival_city, weight='price',
+                max_segments=3, min_layover=timedelta(hours=1)):
+    """
+    Find the optimal itinerary between two cities with an A* search over flights.
+
+    Labels are expanded in order of g + h, where g is the cost accumulated so far and h is a
+    great-circle lower bound to the destination (see _heuristic), so the first label popped at
+    a destination airport is optimal and no full path enumeration is needed. Each connection
+    must respect min_layover, like get_path_details.
+
+    :param G: networkx.MultiDiGraph, flight graph from build_flight_graph function
+           city_to_airports_map: dict, Mapping of cities to their airport codes
+           departure_city: str, origin city
+           arrival_city: str, destination city
+           weight: str, 'price', 'duration' (total flight time) or 'transfers'
+           max_segments: int, default=3, Maximum number of flight segments to consider
+           min_layover: timedelta, minimum required time between arrival and next departure
+
+    :return: route dict in the format of get_path_details, or None if no route exists
+
+    >>> G = nx.MultiDiGraph()
+    >>> city_to_airports_map = {'Moscow': ['SVO'], 'St Petersburg': ['LED'], 'Kazan': ['KZN']}
+    >>> _ = G.add_edge('SVO', 'KZN', scheduled_departure=pd.Timestamp('2020-01-01 10:00'), scheduled_arrival=pd.Timestamp('2020-01-01 11:30'), price=300)
+    >>> _ = G.add_edge('SVO', 'LED', scheduled_departure=pd.Timestamp('2020-01-01 10:00'), scheduled_arrival=pd.Timestamp('2020-01-01 11:00'), price=100)
+    >>> _ = G.add_edge('LED', 'KZN', scheduled_departure=pd.Timestamp('2020-01-01 12:00'), scheduled_arrival=pd.Timestamp('2020-01-01 13:00'), price=100)
+    >>> route = astar_route(G, city_to_airports_map, 'Moscow', 'Kazan', weight='price')
+    >>> [(s['from'], s['to']) for s in route['path']], route['total_price']
+    ([('SVO', 'LED'), ('LED', 'KZN')], 200)
+    >>> astar_route(G, city_to_airports_map, 'Moscow', 'Kazan', weight='transfers')['transfers']
+    0
+    >>> astar_route(G, city_to_airports_map, 'Kazan', 'Moscow') is None
+    True
+    """
+    if G is None:
+        raise ValueError("Flight graph not built")
+
+    if city_to_airports_map is None:
+        raise ValueError("City to airports mapping not provided")
+
+    if weight not in ROUTE_WEIGHTS.values():
+        raise ValueError(f"Unknown route weight: {weight}")
+
+    origin_airports = city_to_airports_map.get(departure_city, [])
+    dest_airports = set(city_to_airports_map.get(arrival_city, []))
+
+    if not origin_airports:
+        raise ValueError(f"No airports found for origin city: {departure_city}")
+
+    if not dest_airports:
+        raise ValueError(f"No airports found for destination city: {arrival_city}")
+
+    dest_airports &= set(G.nodes)
+    if not dest_airports:
+        return None
+
+    h = _heuristic(G, dest_airports, weight)
+    tie_breaker = itertools.count()
+
+    # Heap entries: (g + h, tie_breaker, g, airport, flight, segments so far, label index).
+    # Each label stores (parent label index, origin, dest, flight) for its last segment, so a
+    # push is O(1) and the route is only rebuilt from the parent pointers when it is returned
+    heap = []
+    labels = []
+
+    def push(g, parent, n_segments, origin, dest, flight):
+        cost = _segment_cost(flight, weight)
+        if pd.isna(cost):
+            return
+        labels.append((parent, origin, dest, flight))
+        heapq.heappush(heap, (g + cost + h[dest], next(tie_breaker), g + cost, dest, flight,
+                              n_segments + 1, len(labels) - 1))
+
+    for origin_airport in origin_airports:
+        if not G.has_node(origin_airport) or origin_airport in dest_airports:
+            continue
+        for dest, edge_dict in G.adj[origin_airport].items():
+            for flight in edge_dict.values():
+                push(0, -1, 0, origin_airport, dest, flight)
+
+    # Earliest arrival already expanded per (airport, segments used); a later arrival
+    # with at least as many segments can reach nothing new and costs no less.
+    expanded = {}
+
+    while heap:
+        _, _, g, airport, flight, n_segments, label = heapq.heappop(heap)
+
+        if airport in dest_airports:
+            return _route_details(_label_segments(labels, label))
+
+        if n_segments >= max_segments:
+            continue
+
+        arrival = flight['scheduled_arrival']
+        seen = expanded.setdefault(airport, {})
+        if any(n <= n_segments and t <= arrival for n, t in seen.items()):
+            continue
+        seen[n_segments] = arrival
+
+        visited_airports = set()
+        parent = label
+        while parent >= 0:
+            parent, origin, _, _ = labels[parent]
+            visited_airports.add(origin)
+        ready = arrival + min_layover
+        for neighbor, next_flight in _departures_after(G, airport, ready):
+            if neighbor in visited_airports:
+                continue
+            # The last allowed segment has to land at the destination
+            if n_segments + 1 == max_segments and neighbor not in dest_airports:
+                continue
+            push(g, label, n_segments, airport, neighbor, next_flight)
+
+    return None
+
+
+def _label_segments(labels, label):
+    """
+    Rebuild the (origin, dest, flight) segments of an A* label by following its parent pointers.
+
+    >>> _label_segments([(-1, 'A', 'B', 'f1'), (0, 'B', 'C', 'f2')], 1)
+    [('A', 'B', 'f1'), ('B', 'C', 'f2')]
+    """
+    segments = []
+    while label >= 0:
+        label, origin, dest, flight = labels[label]
+        segments.append((origin, dest, flight))
+    segments.reverse()
+    return segments
+
+
+def _departures_after(G, airport, ready):
+    """
+    (neighbor, flight_data) for every flight leaving airport at or after ready. Uses the
+    departure index of build_flight_graph_full when present (a binary search, no per-flight
+    time checks), otherwise scans the airport's edges.
+    Any flight found this way departs after the query's start, so it is also in a time view.
+    """
+    departures = G.graph.get('departures')
+    if departures is not None and airport in departures:
+        dep_ns, flights = departures[airport]
+        return flights[np.searchsorted(dep_ns, ready.value, side='left'):]
+
+    return [(neighbor, flight_data)
+            for neighbor, edge_dict in G.adj[airport].items()
+            for flight_data in edge_dict.values()
+            if flight_data['scheduled_departure'] >= ready]
+
+
+def find_best_routes(G, city_to_airports_map, departure_city, arrival_city, max_segments=3):
+    """
+    Find the cheapest, fastest and least-transfers routes with one A* search each,
+    instead of enumerating every path with find_all_paths and scoring them.
+
+    :param G: networkx.MultiDiGraph, flight graph from build_flight_graph function
+           city_to_airports_map: dict, Mapping of cities to their airport codes
+           departure_city: str, origin city
+           arrival_city: str, destination city
+           max_segments: int, default=3, Maximum number of flight segments to consider
+    :return: dict with keys 'cheapest', 'fastest', 'least_transfers' like
+             select_best_routes, or None if no route exists. 'cheapest' is left out
+             when no route has a price for every flight.
+
+    >>> G = nx.MultiDiGraph()
+    >>> city_to_airports_map = {'Moscow': ['SVO'], 'St Petersburg': ['LED'], 'Kazan': ['KZN']}
+    >>> _ = G.add_edge('SVO', 'KZN', scheduled_departure=pd.Timestamp('2020-01-01 10:00'), scheduled_arrival=pd.Timestamp('2020-01-01 13:00'), price=300)
+    >>> _ = G.add_edge('SVO', 'LED', scheduled_departure=pd.Timestamp('2020-01-01 10:00'), scheduled_arrival=pd.Timestamp('2020-01-01 11:00'), price=100)
+    >>> _ = G.add_edge('LED', 'KZN', scheduled_departure=pd.Timestamp('2020-01-01 12:00'), scheduled_arrival=pd.Timestamp('2020-01-01 13:00'), price=100)
+    >>> best = find_best_routes(G, city_to_airports_map, 'Moscow', 'Kazan')
+    >>> best['cheapest']['total_price'], best['fastest']['total_duration'], best['least_transfers']['transfers']
+    (200, Timedelta('0 days 02:00:00'), 0)
+    >>> for _, _, data in G.edges(data=True):
+    ...     data['price'] = np.nan
+    >>> sorted(find_best_routes(G, city_to_airports_map, 'Moscow', 'Kazan'))
+    ['fastest', 'least_transfers']
+    """
+    best_routes = {}
+    for route_type, weight in ROUTE_WEIGHTS.items():
+        route = astar_route(G, city_to_airports_map, departure_city, arrival_city,
+                            weight=weight, max_segments=max_segments)
+        if route is not None:
+            best_routes[route_type] = route
+
+    return best_routes or None
@@ -10,18 +10,99 @@ This module handles the preprocessing of flight data tables including:
 - Creating airport-city mappings
 """
 
+import ast
+import re
 import pandas as pd
 import numpy as np
-import ast
 from typing import Dict, List
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# English name in the city JSON of the SQLite export, e.g. '{"en": "Moscow", "ru": "Москва"}'.
+# The regex groups are named, as pyarrow's regex kernel requires
+EN_CITY_PATTERN = r'"en"\s*:\s*"(?P<en>[^"]*)"'
 
-def extract_city_names(df, dep_col: str = 'departure_city', arr_col: str = 'arrival_city'):
+# '(longitude,latitude)' point of the SQLite export; the parentheses are optional. Anchored at
+# both ends and with full float syntax (sign, decimals, exponent), so a malformed string
+# matches nothing and becomes NaN rather than a wrong number read from part of it
+_FLOAT = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+COORDINATE_PATTERN = (r'^\s*\(?\s*(?P<longitude>' + _FLOAT + r')\s*,\s*(?P<latitude>' + _FLOAT
+                      + r')\s*\)?\s*$')
+
+# Compiled once at import; the Arrow path passes the pattern string on to pyarrow
+EN_CITY_RE = re.compile(EN_CITY_PATTERN)
+COORDINATE_RE = re.compile(COORDINATE_PATTERN)
+
+# Timestamp format of the SQLite export, e.g. '2017-09-10 09:50:00+03'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S%z'
+
+
+def _str_extract(series, regex):
+    """
+    Series.str.extract with a compiled regex of named groups, one object column per group
+    (missing values as NA). With pyarrow installed the strings are cast to Arrow strings first, so the
+    regex runs in pyarrow.compute over contiguous UTF-8 instead of on Python str objects;
+    columns that are not all strings fall back to the object path.
+
+    >>> parts = _str_extract(pd.Series(['(1.5, 2)', None]), COORDINATE_RE)
+    >>> parts['latitude'][0], parts['latitude'].isna().tolist()
+    ('2', [False, True])
+    """
+    if pa is not None:
+        try:
+            arrow_series = series.astype(pd.ArrowDtype(pa.string()))
+        except (TypeError, ValueError):
+            pass
+        else:
+            # pyarrow compiles the pattern string itself (it does not take re.Pattern objects)
+            return arrow_series.str.extract(regex.pattern, expand=True).astype(object)
+    return series.astype(object).str.extract(regex, expand=True).astype(object)
+
+
+def _city_name_from_json(city_string):
+    """
+    English name from a city string the regex could not read, parsed as JSON (orjson when
+    installed), also accepting a single-quoted dict repr. Only strings neither JSON parse
+    accepts, e.g. a dict repr with an apostrophe in a name, go through ast.literal_eval.
+    None if there is no "en" name.
+
+    >>> _city_name_from_json("{'en': 'Kazan', 'ru': 'Казань'}"), _city_name_from_json('{"ru": "Казань"}')
+    ('Kazan', None)
+    >>> _city_name_from_json(str({'en': "Saint John's"})), _city_name_from_json('not a dict')
+    ("Saint John's", None)
+    """
+    city_string = str(city_string)
+    for text in (city_string, city_string.replace("'", '"')):
+        try:
+            city = _json_loads(text)
+        except ValueError:
+            continue
+        return city.get('en') if isinstance(city, dict) else None
+    try:
+        city = ast.literal_eval(city_string)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return None
+    return city.get('en') if isinstance(city, dict) else None
+
+
+def extract_city_names(df, dep_col: str = 'departure_city', arr_col: str = 'arrival_city', copy: bool = True):
     """
     Extracts English city names from specified columns containing dictionary-like strings.
     Creates new columns 'departure_city' and 'arrival_city'.
 
     :param df: DataFrame with columns like 'departure_city' and 'arrival_city'
+           copy: bool, default=True, work on a shallow copy; False modifies df itself
     :return df: The original DataFrame with two new columns added:
                       'departure_city_name' and 'arrival_city_name'.
 
@@ -29,44 +110,54 @@ def extract_city_names(df, dep_col: str = 'departure_city', arr_col: str = 'arri
     ...     'departure_city': ['{"en": "Moscow", "ru": "Москва"}',
     ...                        '{"en": "St. Petersburg", "ru": "Санкт-Петербург"}',
     ...                        '{"ru": "Казань"}',
-    ...                        None],
+    ...                        None,
+    ...                        "{'en': 'Kazan', 'ru': 'Казань'}"],
     ...     'arrival_city': ['{"en": "Sochi", "ru": "Сочи"}',
     ...                      '{"en": "Kazan", "ru": "Казань"}',
     ...                      '{"en": "Moscow"}',
-    ...                      '{"en": "Novosibirsk", "ru": "Новосибирск"}']
+    ...                      '{"en": "Novosibirsk", "ru": "Новосибирск"}',
+    ...                      '{"en": "Sochi"}']
     ... })
     >>> result = extract_city_names(df_test.copy())
     >>> result['departure_city_name'].tolist()
-    ['Moscow', 'St. Petersburg', None, None]
+    ['Moscow', 'St. Petersburg', None, None, 'Kazan']
     >>> result['arrival_city_name'].tolist()
-    ['Sochi', 'Kazan', 'Moscow', 'Novosibirsk']
+    ['Sochi', 'Kazan', 'Moscow', 'Novosibirsk', 'Sochi']
+    >>> # names already extracted in SQL are kept as they are
+    >>> parsed = pd.DataFrame({'departure_city_name': ['Moscow'], 'arrival_city_name': ['Sochi']})
+    >>> extract_city_names(parsed)['departure_city_name'].tolist()
+    ['Moscow']
     """
 
-    result_df = df.copy()
-
-    def parse_and_extract(city_string):
-        if pd.isna(city_string):
-            return None
-        try:
-            city_dict = ast.literal_eval(str(city_string))
-            if isinstance(city_dict, dict):
-                return city_dict.get('en')
-            else:
-                return None
-        except (ValueError, SyntaxError, TypeError):
-            return None
-
-    result_df['departure_city_name'] = result_df[dep_col].apply(parse_and_extract)
-    result_df['arrival_city_name'] = result_df[arr_col].apply(parse_and_extract)
+    result_df = df.copy(deep=False) if copy else df
+    if {'departure_city_name', 'arrival_city_name'}.issubset(result_df.columns):
+        return result_df
+
+    # The values are uniform '{"en": "...", "ru": "..."}' strings, so one vectorized regex pass
+    # replaces parsing every cell; only the few strings it misses are parsed as JSON.
+    # There is one string per city, so both columns are stacked and each distinct string is
+    # parsed once, then the names are spread back to the rows by their factorize codes.
+    # Rows without an "en" key (or missing, code -1) become None
+    n = len(result_df)
+    codes, uniques = pd.factorize(pd.concat([result_df[dep_col], result_df[arr_col]], ignore_index=True))
+    values = pd.Series(uniques, dtype=object)
+    names = _str_extract(values, EN_CITY_RE)['en']
+    missed = names.isna().to_numpy()
+    if missed.any():
+        names[missed] = [_city_name_from_json(value) for value in values[missed].to_numpy()]
+    names = np.append(names.where(names.notna(), None).to_numpy(dtype=object), None)[codes]
+    result_df['departure_city_name'] = names[:n]
+    result_df['arrival_city_name'] = names[n:]
 
     return result_df
 
 
-def extract_coordinates(df):
+def extract_coordinates(df, copy: bool = True):
     """
     Extracts longitude and latitude from coordinate columns and creates new columns.
 
     :param df: DataFrame with 'departure_coordinates' and 'arrival_coordinates' columns.
+           copy: bool, default=True, work on a shallow copy; False modifies df itself
     :return df: The original DataFrame with four new columns added for longitude and latitude,
                 or the original DataFrame if input columns are missing.
 
@@ -83,52 +174,60 @@ def extract_coordinates(df):
     [139.6917, -0.1278, 90.0]
     >>> result['arrival_latitude'].tolist()
     [35.6895, 51.5074, -45.0]
+    >>> # exponents are read in full; anything malformed becomes NaN
+    >>> odd = extract_coordinates(pd.DataFrame({'departure_coordinates': ['(1e3, 2)', '(1,)'],
+    ...                                         'arrival_coordinates': ['(1.5, 2)x', '(-0.5, +2.5E-1)']}))
+    >>> odd['departure_longitude'].tolist(), odd['departure_latitude'].tolist()
+    ([1000.0, nan], [2.0, nan])
+    >>> odd['arrival_longitude'].tolist(), odd['arrival_latitude'].tolist()
+    ([nan, -0.5], [nan, 0.25])
     """
-    result_df = df.copy()
-
-    def _process_coordinate_series(coord_series):
-        """Takes a Series of coordinate strings, returns lon and lat Series."""
-        if coord_series is None or coord_series.empty:
-            return pd.Series([np.nan] * len(result_df)), pd.Series([np.nan] * len(result_df))
-
-        # Remove parentheses and split on comma into two parts
-        coords = coord_series.astype(str).str.strip('()')
-        parts = coords.str.split(',', n=1, expand=True)
-
-        lon_str = parts[0]
-        lat_str = parts[1]
-
-        # Convert to numeric, coercing errors to NaN
-        lon_numeric = pd.to_numeric(lon_str, errors='coerce')
-        lat_numeric = pd.to_numeric(lat_str, errors='coerce')
+    result_df = df.copy(deep=False) if copy else df
+    coordinate_cols = ['departure_longitude', 'departure_latitude', 'arrival_longitude', 'arrival_latitude']
+    if set(coordinate_cols).issubset(result_df.columns):
+        # Already parsed in SQL by connect_and_merge_data.py
+        return result_df
+
+    # Stack both coordinate columns and parse each distinct string once: there is one string per
+    # airport, so the regex and the numeric conversion run over ~100 values instead of 2 * N rows
+    prefixes = ['departure', 'arrival']
+    present = [prefix for prefix in prefixes if f"{prefix}_coordinates" in result_df.columns]
+    n = len(result_df)
+    if present:
+        stacked = pd.concat([result_df[f"{prefix}_coordinates"] for prefix in present], ignore_index=True)
+        codes, uniques = pd.factorize(stacked)
+        parts = _str_extract(pd.Series(uniques, dtype=object), COORDINATE_RE)
 
-        return lon_numeric, lat_numeric
+        # Convert to numeric, coercing errors to NaN; missing strings (code -1) pick the trailing NaN
+        lon = np.append(pd.to_numeric(parts['longitude'], errors='coerce').to_numpy(dtype=np.float64), np.nan)[codes]
+        lat = np.append(pd.to_numeric(parts['latitude'], errors='coerce').to_numpy(dtype=np.float64), np.nan)[codes]
 
-    prefixes = ['departure', 'arrival']
     for prefix in prefixes:
-        coord_col = f"{prefix}_coordinates"
         lon_col = f"{prefix}_longitude"
         lat_col = f"{prefix}_latitude"
 
-        if coord_col in result_df.columns:
-            lon_series, lat_series = _process_coordinate_series(result_df[coord_col])
-            result_df[lon_col] = lon_series
-            result_df[lat_col] = lat_series
+        if prefix in present:
+            i = present.index(prefix)
+            result_df[lon_col] = lon[i * n:(i + 1) * n]
+            result_df[lat_col] = lat[i * n:(i + 1) * n]
         else:
-            print("Warning: '{coord_col}' column not found.")
+            print(f"Warning: '{prefix}_coordinates' column not found.")
             result_df[lon_col] = np.nan
             result_df[lat_col] = np.nan
 
     return result_df
 
 
-def process_time_columns(df, dep_col: str = 'scheduled_departure', arr_col: str = 'scheduled_arrival'):
+def process_time_columns(df, dep_col: str = 'scheduled_departure', arr_col: str = 'scheduled_arrival',
+                         copy: bool = True):
     """
     Converts time-related string columns to datetime format and computes flight duration in hours.
 
     :param df: DataFrame with 'scheduled_departure' and 'scheduled_arrival' columns
+           copy: bool, default=True, work on a shallow copy; False modifies df itself
     :return df: Updated DataFrame with:
                 datetime-converted departure and arrival columns
+                dep_ns, arr_ns: the same times as int64 nanoseconds since the epoch (UTC)
                 flight_duration_hours (as float)
 
     >>> df_test = pd.DataFrame({
@@ -138,23 +237,36 @@ def process_time_columns(df, dep_col: str = 'scheduled_departure', arr_col: str
     >>> result = process_time_columns(df_test.copy())
     >>> result['flight_duration_hours'].round(2).tolist()
     [2.0, 2.25]
+    >>> int(result['dep_ns'][0]) == pd.Timestamp('2017-09-02 05:55:00Z').value
+    True
+    >>> process_time_columns(df_test.iloc[:1].assign(scheduled_arrival=[None]))['flight_duration_hours'].tolist()
+    [nan]
     """
 
-    result_df = df.copy()
+    result_df = df.copy(deep=False) if copy else df
 
-    # Converts time to datetime type
-    result_df[dep_col] = pd.to_datetime(result_df[dep_col], errors='coerce')
-    result_df[arr_col] = pd.to_datetime(result_df[arr_col], errors='coerce')
+    # Converts both time columns to datetime type in one call, so the parse cache is shared
+    # between them; an explicit format avoids per-element format inference
+    n = len(result_df)
+    times = pd.to_datetime(pd.concat([result_df[dep_col], result_df[arr_col]], ignore_index=True),
+                           format=TIME_FORMAT, errors='coerce', cache=True)
+    result_df[dep_col] = times.iloc[:n].set_axis(result_df.index)
+    result_df[arr_col] = times.iloc[n:].set_axis(result_df.index)
 
-    # Calculate flight duration in hours
-    result_df['flight_duration_hours'] = (
-        (result_df[arr_col] - result_df[dep_col]).dt.total_seconds() / 3600
-    )
+    # int64 views of the times, for integer time-window comparisons (NaT becomes the int64 minimum)
+    dep_ns = result_df[dep_col].values.view('int64')
+    arr_ns = result_df[arr_col].values.view('int64')
+    result_df['dep_ns'] = dep_ns
+    result_df['arr_ns'] = arr_ns
+
+    # Calculate flight duration in hours from the integer times; NaN if either time is missing
+    missing = result_df[dep_col].isna().to_numpy() | result_df[arr_col].isna().to_numpy()
+    result_df['flight_duration_hours'] = np.where(missing, np.nan, (arr_ns - dep_ns) / 3.6e12)
 
     return result_df
 
 
-def fill_missing_amount_by_route_type(df):
+def fill_missing_amount_by_route_type(df, copy: bool = True):
     """
     Fills missing 'amount' values based on route type (core vs. niche):
     - For core routes (those with flight_id count >= average), missing values are filled using the route's mean amount.
@@ -168,6 +280,7 @@ def fill_missing_amount_by_route_type(df):
                arrival_airport
                flight_id
                amount
+           copy: bool, default=True, work on a shallow copy; False modifies df itself
     :return df: A cleaned DataFrame with all missing 'amount' values handled.
 
     >>> df_test = pd.DataFrame({
@@ -181,36 +294,56 @@ def fill_missing_amount_by_route_type(df):
     >>> cleaned = cleaned.sort_index()
     >>> cleaned['amount'].tolist()
     [100.0, 200.0, 150.0, 300.0, 400.0]
+    >>> categorical = df_test.astype({'departure_airport': 'category', 'arrival_airport': 'category'})
+    >>> fill_missing_amount_by_route_type(categorical)['amount'].tolist()
+    [100.0, 200.0, 150.0, 300.0, 400.0]
+    >>> fill_missing_amount_by_route_type(df_test.dropna())['amount'].tolist()
+    [100.0, 200.0, 300.0, 400.0]
     """
 
-    result_df = df.copy()
+    result_df = df.copy(deep=False) if copy else df
     # this part got help from Chatgpt
-    # Define route as the combination of departure and arrival airports
-    result_df['route'] = result_df['departure_airport'] + ' → ' + result_df['arrival_airport']
-
-    # Count unique flight IDs per route
-    route_flight_counts = result_df.groupby('route')['flight_id'].nunique()
+    # The amounts are coerced to numbers once, so the route mean below runs as the built-in
+    # groupby aggregation
+    result_df['amount'] = pd.to_numeric(result_df['amount'], errors='coerce')
+
+    # Nothing to fill or drop: skip the route grouping altogether
+    missing = result_df['amount'].isna().to_numpy()
+    if not missing.any():
+        return result_df
+
+    # A route is the (departure, arrival) airport pair; grouping on both columns directly
+    # avoids building a 'DEP → ARR' string per row. observed=True keeps categorical airport
+    # columns to the pairs that occur, rather than every combination of categories
+    route_keys = ['departure_airport', 'arrival_airport']
+
+    # Count unique flight IDs per route; route_ids is each row's position in route_flight_counts
+    # (-1 if an airport is missing)
+    routes = result_df.groupby(route_keys, sort=False, observed=True)
+    route_flight_counts = routes['flight_id'].nunique()
+    route_ids = routes.ngroup().fillna(-1).to_numpy(dtype=np.int64)
 
     # Use average flight count per route as the threshold to classify routes
     avg_flight_count = route_flight_counts.mean()
 
-    # Classify routes as 'core' or 'niche'
-    route_type_map = route_flight_counts.apply(lambda x: 'core' if x >= avg_flight_count else 'niche')
-    result_df['route_type'] = result_df['route'].map(route_type_map)
-
-    # Fill missing amounts in core routes with route mean
-    route_mean_amount = result_df.groupby('route')['amount'].transform(
-        lambda x: pd.to_numeric(x, errors='coerce').mean()
-    )
-    result_df['amount'] = result_df.apply(
-        lambda row: route_mean_amount[row.name]
-        if pd.isna(row['amount']) and row['route_type'] == 'core'
-        else row['amount'],
-        axis=1
-    )
-
-    # Drop rows from niche routes where amount is still missing
-    result_df = result_df[~((result_df['route_type'] == 'niche') & (result_df['amount'].isna()))]
+    # Classify routes as core or niche with one comparison per route, spread to the rows;
+    # rows without a route pick the trailing False and are neither
+    route_is_core = route_flight_counts.to_numpy() >= avg_flight_count
+    is_core = np.append(route_is_core, False)[route_ids]
+    is_niche = np.append(~route_is_core, False)[route_ids]
+
+    # Fill missing amounts in core routes with route mean, in one vectorized pass over the
+    # arrays (no Series index alignment as with fillna)
+    route_mean_amount = routes['amount'].transform('mean')
+    fill = missing & is_core
+    amount = np.where(fill, route_mean_amount.to_numpy(), result_df['amount'].to_numpy())
+    result_df['amount'] = amount
+
+    # Drop rows from niche routes where amount is still missing; the frame is only sliced
+    # (which copies every column) when there is such a row
+    drop = is_niche & np.isnan(amount)
+    if drop.any():
+        result_df = result_df.iloc[~drop]
 
     return result_df
 
@@ -236,23 +369,57 @@ def city_to_airports_map(df):
     >>> sorted(mapping['Beijing'])
     ['B', 'C']
     """
-    # Select relevant columns for departure/arrival city-airport pairs and drop any rows with missing values
-    dep = df[['departure_city_name', 'departure_airport']].dropna()
-    arr = df[['arrival_city_name', 'arrival_airport']].dropna()
-
-    # Rename both DataFrames to have the same column names for easy merging
-    dep.columns = ['city', 'airport']
-    arr.columns = ['city', 'airport']
-
-    # Combine departure and arrival records into a single DataFrame and remove duplicates
-    combined = pd.concat([dep, arr], ignore_index=True).drop_duplicates()
-
-    # Group by city and collect all unique associated airports, sorted alphabetically
-    mapping = (
-        combined.groupby('city')['airport']
-        .unique()
-        .apply(sorted)
-        .to_dict()
-    )
-
-    return mapping
\ No newline at end of file
+    # Stack the departure and arrival (city, airport) pairs, dropping pairs with a missing value
+    cities = np.concatenate([df['departure_city_name'].to_numpy(dtype=object),
+                             df['arrival_city_name'].to_numpy(dtype=object)])
+    airports = np.concatenate([df['departure_airport'].to_numpy(dtype=object),
+                               df['arrival_airport'].to_numpy(dtype=object)])
+    present = pd.notna(cities) & pd.notna(airports)
+    cities, airports = cities[present], airports[present]
+
+    # Integer codes in alphabetical order (factorize hashes the strings once), so a single
+    # np.unique over city_code * n_airports + airport_code both drops the duplicate pairs and
+    # sorts them by city, then airport
+    city_codes, city_names = pd.factorize(cities, sort=True)
+    airport_codes, airport_names = pd.factorize(airports, sort=True)
+    pairs = np.unique(city_codes.astype(np.int64) * len(airport_names) + airport_codes)
+    pair_cities, pair_airports = np.divmod(pairs, len(airport_names))
+
+    # Each city's airports are a consecutive slice of the sorted pairs
+    mapping = {}
+    starts = np.flatnonzero(np.diff(pair_cities, prepend=-1))
+    ends = np.append(starts[1:], len(pairs))
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        mapping[city_names[pair_cities[start]]] = airport_names[pair_airports[start:end]].tolist()
+
+    return mapping
+
+
+def preprocess_all(df):
+    """
+    Runs extract_city_names, extract_coordinates, process_time_columns and
+    fill_missing_amount_by_route_type on one shallow copy of df, instead of each step
+    copying the frame returned by the previous one.
+
+    :param df: DataFrame as exported by connect_and_merge_data.py (raw or SQL-cleaned)
+    :return df: The preprocessed DataFrame; df itself is left unchanged
+
+    >>> df_test = pd.DataFrame({
+    ...     'flight_id': [1, 2],
+    ...     'departure_airport': ['SVO', 'SVO'], 'arrival_airport': ['LED', 'LED'],
+    ...     'departure_city': ['{"en": "Moscow"}'] * 2, 'arrival_city': ['{"en": "St. Petersburg"}'] * 2,
+    ...     'departure_coordinates': ['(37.41, 55.97)'] * 2, 'arrival_coordinates': ['(30.26, 59.80)'] * 2,
+    ...     'scheduled_departure': ['2017-09-02 08:55:00+03'] * 2, 'scheduled_arrival': ['2017-09-02 10:25:00+03'] * 2,
+    ...     'amount': [100.0, None]
+    ... })
+    >>> result = preprocess_all(df_test)
+    >>> result['amount'].tolist(), result['flight_duration_hours'].tolist(), result['arrival_city_name'][0]
+    ([100.0, 100.0], [1.5, 1.5], 'St. Petersburg')
+    >>> 'flight_duration_hours' in df_test.columns
+    False
+    """
+    result_df = df.copy(deep=False)
+    result_df = extract_city_names(result_df, copy=False)
+    result_df = extract_coordinates(result_df, copy=False)
+    result_df = process_time_columns(result_df, copy=False)
+    return fill_missing_amount_by_route_type(result_df, copy=False)